@@ -5,6 +5,8 @@ import numpy as np
 import scipy.optimize as opt
 import os
 import sys
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import matplotlib.pyplot as plt
 from astropy.io import ascii
 from TheCannon import *
@@ -83,14 +85,35 @@ def get_starmask(ids, labels, aspcapflag, paramflag):
     return cuts | aspcapflag_bad | paramflag_bad 
 
 
-def load_spectra(data_dir):
+def _load_wl(fits_file):
+    """ Reads the rest-frame wavelength grid from an apogee fits header """
+    header = pyfits.getheader(fits_file, 1)
+    npixels = header['NAXIS1']
+    wl_full_log = header['CRVAL1'] + header['CDELT1'] * np.arange(npixels)
+    return np.power(10., wl_full_log)
+
+
+def _load_spectrum(fits_file):
+    """ Reads the flux and flux uncertainty of one apogee fits file """
+    with pyfits.open(fits_file, memmap=False) as file_in:
+        flux = np.asarray(file_in[1].data)
+        flux_err = np.asarray(file_in[2].data)
+    return flux, flux_err
+
+
+def load_spectra(data_dir, n_threads=None):
     """ Reads wavelength, flux, and flux uncertainty data from apogee fits files
 
+    Files are read by a pool of threads, since loading is I/O bound
+
     Parameters
     ----------
     data_dir: str
         Name of the directory containing all of the data files
 
+    n_threads: int
+        Number of threads reading files, default min(32, 4*ncpus)
+
     Returns
     -------
     wl: ndarray
@@ -106,30 +129,30 @@ def load_spectra(data_dir):
     files = list(sorted([data_dir + "/" + filename
              for filename in os.listdir(data_dir) if filename.endswith('fits')]))
     nstars = len(files)  
-    for jj, fits_file in enumerate(files):
-        file_in = pyfits.open(fits_file)
-        flux = np.array(file_in[1].data)
-        if jj == 0:
-            npixels = len(flux)
-            fluxes = np.zeros((nstars, npixels), dtype=float)
-            ivars = np.zeros(fluxes.shape, dtype=float)
-            start_wl = file_in[1].header['CRVAL1']
-            diff_wl = file_in[1].header['CDELT1']
-            val = diff_wl * (npixels) + start_wl
-            wl_full_log = np.arange(start_wl,val, diff_wl)
-            wl_full = [10 ** aval for aval in wl_full_log]
-            wl = np.array(wl_full)
-        flux_err = np.array((file_in[2].data))
-        badpix = get_pixmask(flux, flux_err)
-        ivar = np.zeros(npixels)
-        ivar[~badpix] = 1. / flux_err[~badpix]**2
-        fluxes[jj,:] = flux
-        ivars[jj,:] = ivar
+    if n_threads is None:
+        n_threads = min(32, 4 * cpu_count())
+    # every file shares the wavelength grid, so read it once up front
+    wl = _load_wl(files[0])
+    npixels = len(wl)
+    # spectra are stored as 32-bit floats, so keep that precision
+    fluxes = np.zeros((nstars, npixels), dtype=np.float32)
+    ivars = np.zeros(fluxes.shape, dtype=np.float32)
+    pool = ThreadPool(processes=n_threads)
+    try:
+        spectra = pool.imap(_load_spectrum, files)
+        for jj, (flux, flux_err) in enumerate(spectra):
+            badpix = get_pixmask(flux, flux_err)
+            # ivars are preallocated as zeros, so bad pixels are left at 0
+            np.divide(1., flux_err**2, out=ivars[jj,:], where=~badpix)
+            fluxes[jj,:] = flux
+    finally:
+        # on an error, drop the reads still queued instead of waiting
+        pool.terminate()
+        pool.join()
     # convert filenames to actual IDs
     names = np.array([f.split('v304-')[1].split('.fits')[0] for f in files])
     print("Spectra loaded")
-    # make sure they are numpy arrays
-    return np.array(names), np.array(wl), np.array(fluxes), np.array(ivars)
+    return names, wl, fluxes, ivars
 
 
 def load_labels(filename):
@@ -296,7 +296,7 @@ class Dataset(object):
 
 
     def continuum_normalize_training_q(self, q, delta_lambda,
-                                       n_proc=1, verbose=True):
+                                       n_proc=1, verbose=False):
         """ Continuum normalize the training set using a running quantile
 
         Parameters
@@ -305,6 +305,8 @@ class Dataset(object):
             The quantile cut
         delta_lambda: float
             The width of the pixel range used to calculate the median
+        verbose: bool
+            Print a progress line for every star
 
 
         Modified by:
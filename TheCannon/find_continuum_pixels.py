@@ -3,8 +3,8 @@ import numpy as np
 LARGE = 200.
 SMALL = 1. / LARGE
 
-def _find_contpix_given_cuts(f_cut, sig_cut, wl, fluxes, ivars):
-    """ Find and return continuum pixels given the flux and sigma cut
+def _find_contpix_given_stats(f_cut, sig_cut, f_bar, sigma_f):
+    """ Find and return continuum pixels given the per-pixel flux statistics
 
     Parameters
     ----------
@@ -12,20 +12,16 @@ def _find_contpix_given_cuts(f_cut, sig_cut, wl, fluxes, ivars):
         the upper limit imposed on the quantity (fbar-1)
     sig_cut: float
         the upper limit imposed on the quantity (f_sig)
-    wl: numpy ndarray of length npixels
-        rest-frame wavelength vector
-    fluxes: numpy ndarray of shape (nstars, npixels)
-        pixel intensities
-    ivars: numpy ndarray of shape nstars, npixels
-        inverse variances, parallel to fluxes
+    f_bar: numpy ndarray of length npixels
+        median flux of each pixel across all stars
+    sigma_f: numpy ndarray of length npixels
+        variance of the flux of each pixel across all stars
 
     Returns
     -------
     contmask: boolean mask of length npixels
         True indicates that the pixel is continuum
     """
-    f_bar = np.median(fluxes, axis=0)
-    sigma_f = np.var(fluxes, axis=0)
     bad = np.logical_and(f_bar==0, sigma_f==0)
     cont1 = np.abs(f_bar-1) <= f_cut
     cont2 = sigma_f <= sig_cut
@@ -64,17 +60,20 @@ def _find_contpix(wl, fluxes, ivars, target_frac):
     f_cut = 0.0001
     stepsize = 0.0001
     sig_cut = 0.0001
-    contmask = _find_contpix_given_cuts(f_cut, sig_cut, wl, fluxes, ivars)
+    # the flux statistics do not depend on the cuts, so only compute them once
+    f_bar = np.median(fluxes, axis=0)
+    sigma_f = np.var(fluxes, axis=0)
+    contmask = _find_contpix_given_stats(f_cut, sig_cut, f_bar, sigma_f)
     if npixels > 0:
-        frac = sum(contmask)/float(npixels)
+        frac = np.count_nonzero(contmask)/float(npixels)
     else:
         frac = 0
     while (frac < target_frac): 
         f_cut += stepsize
         sig_cut += stepsize
-        contmask = _find_contpix_given_cuts(f_cut, sig_cut, wl, fluxes, ivars)
+        contmask = _find_contpix_given_stats(f_cut, sig_cut, f_bar, sigma_f)
         if npixels > 0:
-            frac = sum(contmask)/float(npixels)
+            frac = np.count_nonzero(contmask)/float(npixels)
         else:
             frac = 0
     if frac > 0.10*npixels:
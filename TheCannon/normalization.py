@@ -7,6 +7,10 @@ import scipy.optimize as opt
 
 SMALL = 1.0/200
 
+# Chebyshev bases already built by _chebyshev_basis, keyed by contmask and deg
+MAX_CHEBYSHEV_BASES = 8
+_chebyshev_bases = {}
+
 def _partial_func(func, *args, **kwargs):
     def wrap(x, *p):
         return func(x, p, **kwargs)
@@ -147,6 +151,100 @@ def _cont_norm_gaussian_smooth(dataset, L):
     return norm_tr_flux, norm_tr_ivar, norm_test_flux, norm_test_ivar 
 
 
+def _chebyshev_basis(contmask, deg):
+    """ Chebyshev basis used to fit a continuum to the pixels in contmask
+
+    The basis only depends on contmask and deg, so the most recent ones are
+    cached and shared by every fit to the same segment, e.g. the training
+    and the test set. The returned arrays are read-only.
+
+    Parameters
+    ----------
+    contmask: numpy ndarray of length (npixels)
+        boolean pixel mask, True indicates that pixel is continuum 
+    deg: int
+        degree of the Chebyshev polynomial
+
+    Returns
+    -------
+    vander: numpy ndarray of shape (ncont, deg+1)
+        the Chebyshev Vandermonde matrix at the continuum pixels
+    vander_all: numpy ndarray of shape (npixels, deg+1)
+        the Chebyshev Vandermonde matrix at every pixel
+    """
+    contmask = np.asarray(contmask, dtype=bool)
+    key = (contmask.tobytes(), deg)
+    if key not in _chebyshev_bases:
+        # a run only fits a few segments at a time, so rather than keeping
+        # every basis ever built, start over once the cache is full
+        if len(_chebyshev_bases) >= MAX_CHEBYSHEV_BASES:
+            _chebyshev_bases.clear()
+        pix = np.arange(0, len(contmask))
+        x = pix[contmask]
+        # map the continuum pixels onto [-1, 1], as Chebyshev.fit does
+        off, scl = np.polynomial.polyutils.mapparms(
+                [x.min(), x.max()], [-1, 1])
+        vander = np.polynomial.chebyshev.chebvander(off + scl*x, deg)
+        vander_all = np.polynomial.chebyshev.chebvander(off + scl*pix, deg)
+        for basis in (vander, vander_all):
+            basis.flags.writeable = False
+        _chebyshev_bases[key] = (vander, vander_all)
+    return _chebyshev_bases[key]
+
+
+def _find_cont_chebyshev(fluxes, ivars, contmask, deg, batch=1000):
+    """ Fit a Chebyshev polynomial continuum to all spectra at once
+
+    Gives the same result as calling Chebyshev.fit(x, y, w=yivar, deg=deg)
+    on each spectrum in turn, but solves the weighted least-squares problems
+    for a whole batch of stars in one stacked call.
+
+    Parameters
+    ----------
+    fluxes: numpy ndarray of shape (nstars, npixels)
+        training set or test set pixel intensities
+
+    ivars: numpy ndarray of shape (nstars, npixels)
+        inverse variances, parallel to fluxes
+
+    contmask: numpy ndarray of length (npixels)
+        boolean pixel mask, True indicates that pixel is continuum 
+
+    deg: int
+        degree of the Chebyshev polynomial
+
+    batch: int
+        number of stars solved together
+
+    Returns
+    -------
+    cont: numpy ndarray of shape (nstars, npixels)
+        the continuum, parallel to fluxes and of the same dtype
+    """
+    vander, vander_all = _chebyshev_basis(contmask, deg)
+    # fit in double precision whatever the storage type of the spectra
+    y = fluxes[:,contmask].astype(np.float64)
+    yivar = ivars[:,contmask].astype(np.float64)
+    yivar[yivar == 0] = SMALL**2
+    nstars, ncont = y.shape
+    rcond = ncont * np.finfo(np.float64).eps
+    coeffs = np.zeros((nstars, deg+1))
+    # solve in batches of stars to bound the size of the design matrices
+    for start in range(0, nstars, batch):
+        stop = start + batch
+        # weighted design matrix of each star, with its columns scaled to
+        # unit norm to improve the conditioning, as in chebfit
+        lhs = yivar[start:stop,:,None] * vander
+        rhs = yivar[start:stop] * y[start:stop]
+        scl = np.sqrt(np.sum(lhs**2, axis=1))
+        scl[scl == 0] = 1
+        lhs /= scl[:,None,:]
+        coeffs[start:stop] = np.einsum(
+                'ikj,ij->ik', np.linalg.pinv(lhs, rcond), rhs) / scl
+    # evaluate all the continua as one product with the full-segment basis
+    return np.dot(coeffs, vander_all.T).astype(fluxes.dtype, copy=False)
+
+
 def _find_cont_fitfunc(fluxes, ivars, contmask, deg, ffunc, n_proc=1):
     """ Fit a continuum to a continuum pixels in a segment of spectra
 
@@ -169,6 +267,10 @@ def _find_cont_fitfunc(fluxes, ivars, contmask, deg, ffunc, n_proc=1):
     ffunc: str
         type of fitting function, chebyshev or sinusoid
 
+    n_proc: int
+        number of processes fitting the sinusoid, one star at a time;
+        ignored for chebyshev, which fits all stars in one stacked solve
+
     Returns
     -------
     cont: numpy ndarray of shape (nstars, npixels)
@@ -176,35 +278,32 @@ def _find_cont_fitfunc(fluxes, ivars, contmask, deg, ffunc, n_proc=1):
     """
     nstars = fluxes.shape[0]
     npixels = fluxes.shape[1]
-    cont = np.zeros(fluxes.shape)
 
-    if n_proc == 1:
+    if ffunc=="chebyshev":
+        # every star is fitted in one stacked solve, so there is nothing
+        # to gain from farming single stars out to a process pool
+        cont = _find_cont_chebyshev(fluxes, ivars, contmask, deg)
+    elif n_proc == 1:
+        cont = np.zeros(fluxes.shape, dtype=fluxes.dtype)
+        pix = np.arange(0, npixels)
+        x = pix[contmask]
         for jj in range(nstars):
             flux = fluxes[jj,:]
             ivar = ivars[jj,:]
-            pix = np.arange(0, npixels)
             y = flux[contmask]
-            x = pix[contmask]
             yivar = ivar[contmask]
             yivar[yivar == 0] = SMALL**2
-            if ffunc=="sinusoid":
-                p0 = np.ones(deg*2) # one for cos, one for sin
-                L = max(x)-min(x)
-                pcont_func = _partial_func(_sinusoid, L=L, y=flux)
-                popt, pcov = opt.curve_fit(pcont_func, x, y, p0=p0,
-                                           sigma=1./np.sqrt(yivar))
-            elif ffunc=="chebyshev":
-                fit = np.polynomial.chebyshev.Chebyshev.fit(x=x,y=y,w=yivar,deg=deg)
-            for element in pix:
-                if ffunc=="sinusoid":
-                    cont[jj,element] = _sinusoid(element, popt, L=L, y=flux)
-                elif ffunc=="chebyshev":
-                    cont[jj,element] = fit(element)
+            p0 = np.ones(deg*2) # one for cos, one for sin
+            L = max(x)-min(x)
+            pcont_func = _partial_func(_sinusoid, L=L, y=flux)
+            popt, pcov = opt.curve_fit(pcont_func, x, y, p0=p0,
+                                       sigma=1./np.sqrt(yivar))
+            cont[jj,:] = _sinusoid(pix, popt, L=L, y=flux)
     else:
         # start mp.Pool
         pool = mp.Pool(processes=n_proc)
         mp_results = []
-        for i in xrange(nstars):
+        for i in range(nstars):
             mp_results.append(pool.apply_async(\
                 _find_cont_fitfunc,
                 (fluxes[i, :].reshape((1, -1)),
@@ -215,7 +314,7 @@ def _find_cont_fitfunc(fluxes, ivars, contmask, deg, ffunc, n_proc=1):
         pool.close()
         pool.join()
 
-        cont = np.array([mp_results[i].get().flatten() for i in xrange(nstars)])
+        cont = np.array([mp_results[i].get().flatten() for i in range(nstars)])
 
     return cont
 
@@ -250,7 +349,7 @@ def _find_cont_fitfunc_regions(fluxes, ivars, contmask, deg, ranges, ffunc,
     """
     nstars = fluxes.shape[0]
     npixels = fluxes.shape[1]
-    cont = np.zeros(fluxes.shape)
+    cont = np.zeros(fluxes.shape, dtype=fluxes.dtype)
     for chunk in ranges:
         start = chunk[0]
         stop = chunk[1]
@@ -326,11 +425,10 @@ def _find_cont_running_quantile(wl, fluxes, ivars, q, delta_lambda,
 ####################################################
 
 
-def _cont_norm_running_quantile(wl, fluxes, ivars, q, delta_lambda, verbose=True):
+def _cont_norm_running_quantile(wl, fluxes, ivars, q, delta_lambda, verbose=False):
     cont = _find_cont_running_quantile(wl, fluxes, ivars, q, delta_lambda, verbose=verbose)
-    norm_fluxes = np.ones(fluxes.shape)
-    # norm_ivars = np.zeros(ivars.shape)
-    norm_fluxes[cont!=0] = fluxes[cont!=0] / cont[cont!=0]
+    norm_fluxes = np.ones(fluxes.shape, dtype=fluxes.dtype)
+    np.divide(fluxes, cont, out=norm_fluxes, where=cont!=0)
     norm_ivars = cont**2 * ivars
     return norm_fluxes, norm_ivars
 
@@ -363,8 +461,8 @@ def _cont_norm_running_quantile_mp(wl, fluxes, ivars, q, delta_lambda,
     cont = np.zeros_like(fluxes)
     for i in xrange(nStar):
         cont[i, :] = mp_results[i].get() #.flatten()
-    norm_fluxes = np.ones(fluxes.shape)
-    norm_fluxes[cont!=0] = fluxes[cont!=0] / cont[cont!=0]
+    norm_fluxes = np.ones(fluxes.shape, dtype=fluxes.dtype)
+    np.divide(fluxes, cont, out=norm_fluxes, where=cont!=0)
     norm_ivars = cont**2 * ivars
 
     print('@Bo Zhang: continuum normalization finished!')
@@ -378,21 +476,21 @@ def _cont_norm_running_quantile_mp(wl, fluxes, ivars, q, delta_lambda,
 
 
 def _cont_norm_running_quantile_regions(wl, fluxes, ivars, q, delta_lambda,
-                                        ranges, verbose=True):
+                                        ranges, verbose=False):
     """ Perform continuum normalization using running quantile, for spectrum
     that comes in chunks
     """
     print("contnorm.py: continuum norm using running quantile")
     print("Taking spectra in %s chunks" % len(ranges))
     nstars = fluxes.shape[0]
-    norm_fluxes = np.zeros(fluxes.shape)
-    norm_ivars = np.zeros(ivars.shape)
+    norm_fluxes = np.zeros(fluxes.shape, dtype=fluxes.dtype)
+    norm_ivars = np.zeros(ivars.shape, dtype=ivars.dtype)
     for chunk in ranges:
         start = chunk[0]
         stop = chunk[1]
         output = _cont_norm_running_quantile(
                 wl[start:stop], fluxes[:,start:stop],
-                ivars[:,start:stop], q, delta_lambda)
+                ivars[:,start:stop], q, delta_lambda, verbose=verbose)
         norm_fluxes[:,start:stop] = output[0]
         norm_ivars[:,start:stop] = output[1]
     return norm_fluxes, norm_ivars
@@ -413,8 +511,8 @@ def _cont_norm_running_quantile_regions_mp(wl, fluxes, ivars, q, delta_lambda,
     print("Taking spectra in %s chunks" % len(ranges))
     # nstars = fluxes.shape[0]
     nchunks = len(ranges)
-    norm_fluxes = np.zeros(fluxes.shape)
-    norm_ivars = np.zeros(ivars.shape)
+    norm_fluxes = np.zeros(fluxes.shape, dtype=fluxes.dtype)
+    norm_ivars = np.zeros(ivars.shape, dtype=ivars.dtype)
     for i in xrange(nchunks):
         chunk = ranges[i, :]
         start = chunk[0]
@@ -450,13 +548,8 @@ def _cont_norm(fluxes, ivars, cont):
     norm_ivars: numpy ndarray
         rescaled inverse variances
     """
-    nstars = fluxes.shape[0]
-    npixels = fluxes.shape[1]
-    norm_fluxes = np.ones(fluxes.shape)
-    norm_ivars = np.zeros(ivars.shape)
-    bad = cont == 0.
-    norm_fluxes = np.ones(fluxes.shape)
-    norm_fluxes[~bad] = fluxes[~bad] / cont[~bad]
+    norm_fluxes = np.ones(fluxes.shape, dtype=fluxes.dtype)
+    np.divide(fluxes, cont, out=norm_fluxes, where=cont!=0.)
     norm_ivars = cont**2 * ivars
     return norm_fluxes, norm_ivars 
 
@@ -484,18 +577,16 @@ def _cont_norm_regions(fluxes, ivars, cont, ranges):
     norm_ivars: numpy ndarray
         rescaled inverse variances
     """
-    nstars = fluxes.shape[0]
-    norm_fluxes = np.zeros(fluxes.shape)
-    norm_ivars = np.zeros(ivars.shape)
+    norm_fluxes = np.ones(fluxes.shape, dtype=fluxes.dtype)
+    norm_ivars = np.zeros(ivars.shape, dtype=ivars.dtype)
     for chunk in ranges:
         start = chunk[0]
         stop = chunk[1]
-        output = _cont_norm(fluxes[:,start:stop],
-                           ivars[:,start:stop],
-                           cont[:,start:stop])
-        norm_fluxes[:,start:stop] = output[0]
-        norm_ivars[:,start:stop] = output[1]
-    for jj in range(nstars):
-        bad = (norm_ivars[jj,:] == 0.)
-        norm_fluxes[jj,:][bad] = 1.
+        # write straight into the outputs; pixels with zero rescaled ivar
+        # (including those where cont == 0) keep a flux of 1
+        chunk_ivars = norm_ivars[:,start:stop]
+        np.multiply(cont[:,start:stop], cont[:,start:stop], out=chunk_ivars)
+        np.multiply(chunk_ivars, ivars[:,start:stop], out=chunk_ivars)
+        np.divide(fluxes[:,start:stop], cont[:,start:stop],
+                  out=norm_fluxes[:,start:stop], where=chunk_ivars != 0.)
     return norm_fluxes, norm_ivars
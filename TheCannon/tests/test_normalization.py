@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from TheCannon.normalization import SMALL, _find_cont_fitfunc
+
+
+def _chebyshev_fit_each(fluxes, ivars, contmask, deg):
+    """ Reference continua from Chebyshev.fit, one star at a time """
+    pix = np.arange(fluxes.shape[1])
+    cont = np.zeros(fluxes.shape)
+    for jj in range(fluxes.shape[0]):
+        yivar = ivars[jj,contmask].copy()
+        yivar[yivar == 0] = SMALL**2
+        fit = np.polynomial.chebyshev.Chebyshev.fit(
+                pix[contmask], fluxes[jj,contmask], w=yivar, deg=deg)
+        cont[jj,:] = fit(pix)
+    return cont
+
+
+def _spectra(nstars=20, npixels=400, ncont=40, seed=0):
+    rng = np.random.RandomState(seed)
+    pix = np.arange(npixels)
+    fluxes = (1 + 0.05*np.sin(pix/150.))[None,:] \
+            + 0.01*rng.randn(nstars, npixels)
+    ivars = rng.uniform(1e3, 1e4, (nstars, npixels))
+    ivars[rng.rand(nstars, npixels) < 0.05] = 0
+    contmask = np.zeros(npixels, dtype=bool)
+    contmask[rng.choice(npixels, ncont, replace=False)] = True
+    return fluxes, ivars, contmask
+
+
+def test_chebyshev_matches_per_star_fit():
+    fluxes, ivars, contmask = _spectra()
+    cont = _find_cont_fitfunc(fluxes, ivars, contmask, 3, "chebyshev")
+    expected = _chebyshev_fit_each(fluxes, ivars, contmask, 3)
+    assert np.allclose(cont, expected, rtol=0, atol=1e-10)
+
+
+@pytest.mark.parametrize("ngood", [1, 2, 3])
+def test_chebyshev_heavily_masked_star(ngood):
+    # one star keeps only a few good continuum pixels, all at high ivar,
+    # so its weights span ~20 orders of magnitude
+    fluxes, ivars, contmask = _spectra()
+    contpix = np.flatnonzero(contmask)
+    ivars[0,:] = 0
+    ivars[0,contpix[:ngood]] = 1e6
+    cont = _find_cont_fitfunc(fluxes, ivars, contmask, 3, "chebyshev")
+    expected = _chebyshev_fit_each(fluxes, ivars, contmask, 3)
+    assert np.all(np.isfinite(cont))
+    assert np.allclose(cont[0], expected[0], rtol=0, atol=1e-4)
+    assert np.allclose(cont[1:], expected[1:], rtol=0, atol=1e-10)
@@ -36,13 +36,15 @@ if __name__=="__main__":
     ny = 10
     nmin = 20
 
-    total_age, xedges, yedges, im2 = plt.hist2d(
-            mh, am, bins=[nx,ny], weights = age * age_err, 
-            normed = False, cmin=nmin)
-    total_err, xedges, yedges, im3 = plt.hist2d(
-            mh, am, bins=[nx,ny], weights = age_err, 
-            normed = False, cmin=nmin)
-    mean_age = total_age / total_err
+    total_age, xedges, yedges = np.histogram2d(
+            mh, am, bins=[nx,ny], weights = age * age_err)
+    total_err, xedges, yedges = np.histogram2d(
+            mh, am, bins=[nx,ny], weights = age_err)
+    # same cut as cmin in plt.hist2d: bins below nmin are left as NaN
+    good = np.logical_and(total_age >= nmin, total_err >= nmin)
+    mean_age = np.divide(
+            total_age, total_err, out=np.full_like(total_age, np.nan),
+            where=good)
 
     #fig, (ax1, ax2) = plt.subplots(ncols=2, figsize=(12,6))
     fig = plt.figure(figsize=(8,4))
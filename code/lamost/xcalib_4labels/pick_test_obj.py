@@ -2,14 +2,24 @@
 neighbor APOGEE labels in the training set. """
 
 import numpy as np
+from scipy.spatial import cKDTree
 import os
 import glob
 
-def calc_dist(lamost_point, training_points, coeffs):
-    """ dists from one lamost point to all training points """
-    diff2 = (training_points - lamost_point)**2
-    dist = np.sqrt(np.sum(diff2*coeffs, axis=1))
-    return np.mean(dist[dist.argsort()][0:10])
+def calc_dist(lamost_points, training_points, coeffs):
+    """ mean dist from each lamost point to its 10 nearest training points """
+    # rescale the labels so that the weighted distance is euclidean
+    scale = np.sqrt(coeffs)
+    # the tree only takes finite labels: skip bad training rows, and give
+    # bad lamost rows an infinite distance so they are never selected
+    finite = np.all(np.isfinite(training_points), axis=1)
+    tree = cKDTree(training_points[finite]*scale, leafsize=32)
+    nnear = min(10, np.count_nonzero(finite))
+    good = np.all(np.isfinite(lamost_points), axis=1)
+    dist = tree.query(lamost_points[good]*scale, k=nnear)[0]
+    training_dist = np.full(len(lamost_points), np.inf)
+    training_dist[good] = np.mean(dist.reshape(-1, nnear), axis=1)
+    return training_dist
 
 
 def find_test_obj(date):
@@ -19,32 +29,28 @@ def find_test_obj(date):
         training_points = a['arr_0'][:,0:3]
     labels = np.load("lamost_labels/lamost_labels_%s.npz" %date)['arr_0']
     lamost_label_id = labels[:,0]
-    lamost_teff = labels[:,1].astype(np.float)
-    lamost_logg = labels[:,2].astype(np.float)
-    lamost_feh = labels[:,3].astype(np.float)
+    lamost_teff = labels[:,1].astype(float)
+    lamost_logg = labels[:,2].astype(float)
+    lamost_feh = labels[:,3].astype(float)
 
     lamost_points = np.vstack((lamost_teff, lamost_logg, lamost_feh)).T
     coeffs = 1./(np.array([100,0.2,0.1])**2)
 
     print("calculating training distances")
-    training_dist = np.array(
-            [calc_dist(p, training_points, coeffs) for p in lamost_points])
+    training_dist = calc_dist(lamost_points, training_points, coeffs)
 
     print("finding the test objects")
     test_obj = lamost_label_id[training_dist < 2.5]
 
-    outputf = open('test_obj/%s_test_obj.txt' %date, "w")
-    for obj in test_obj: 
-        outputf.write(obj + '\n')
-    outputf.close()
+    with open('test_obj/%s_test_obj.txt' %date, "w") as outputf:
+        outputf.write("".join(obj + '\n' for obj in test_obj))
 
 
 if __name__ == "__main__":
     dates = os.listdir("/home/share/LAMOST/DR2/DR2_release")
     dates = np.array(dates)
-    dates = np.delete(dates, np.where(dates=='.directory')[0][0])
-    dates = np.delete(dates, np.where(dates=='all_folders.list')[0][0])
-    dates = np.delete(dates, np.where(dates=='dr2.lis')[0][0])
+    not_dates = ['.directory', 'all_folders.list', 'dr2.lis']
+    dates = dates[~np.isin(dates, not_dates)]
     find_test_obj('20120105')
     find_test_obj('20120201')
     find_test_obj('20121017')
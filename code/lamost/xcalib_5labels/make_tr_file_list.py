@@ -10,8 +10,8 @@ npix = np.array([np.count_nonzero(ivar[jj,:]) for jj in range(0,11057)])
 good_frac = npix/3626. 
 SNR_raw = flux * ivar**0.5
 bad = SNR_raw == 0
-SNR_raw = np.ma.array(SNR_raw, mask=bad)
-SNR = np.ma.median(SNR_raw, axis=1)
+SNR_raw[bad] = np.nan
+SNR = np.nanmedian(SNR_raw, axis=1)
 
 # we want to have at least 94% of pixels, and SNR of at least 100 
 good = np.logical_and(good_frac > 0.94, SNR>100) 